@@ -1,13 +1,40 @@
-from .database import MongoDB
+import asyncio
+import logging
 
-# Initialize MongoDB connection when the app starts
-def startup_event():
-    print("Initializing MongoDB connection pool...")
-    # Connection will be established on first request
+from .database import MongoDB, db
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on the startup ping, well below the 30s server selection default
+WARMUP_TIMEOUT_SECONDS = 5
+
+# Run from the FastAPI lifespan in app.main
+async def startup_event():
+    logger.info("Initializing MongoDB connection pool...")
+    from .routers.reports import DATABASE_MAP, start_pdf_pool
+
+    start_pdf_pool()
+
+    # Open the pool now so the first request doesn't pay the SRV/TLS handshake
+    try:
+        await asyncio.wait_for(db.client.admin.command("ping"), WARMUP_TIMEOUT_SECONDS)
+    except Exception:
+        # Index creation would only wait out the same timeout once per database
+        logger.exception("Could not reach MongoDB; skipping index creation")
+        return
+
+    for db_name in DATABASE_MAP.values():
+        try:
+            await db.ensure_indexes(db_name)
+        except Exception:
+            logger.exception("Could not ensure indexes on %s", db_name)
 
 def shutdown_event():
-    print("Closing MongoDB connections...")
-    MongoDB.close()
+    logger.info("Closing MongoDB connections...")
+    db.close()
+
+    from .routers.reports import stop_pdf_pool
+    stop_pdf_pool()
 
 # Corrected: Double underscores for __all__
-__all__ = ["MongoDB"]  # Explicit exports
\ No newline at end of file
+__all__ = ["MongoDB"]  # Explicit exports
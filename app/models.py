@@ -27,5 +27,4 @@ class FullReportResponse(BaseModel):
     success: bool
     payment_report: List[PaymentReportItem]
     clinic_report: ClinicReportItem
-    sales_report: SalesReportItem
-    pdf_bytes: str
\ No newline at end of file
+    sales_report: SalesReportItem
\ No newline at end of file
@@ -1,21 +1,30 @@
-from fastapi import APIRouter, HTTPException
-from datetime import datetime
-from typing import List, Dict, Any
+import asyncio
+import hashlib
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from weakref import WeakValueDictionary
+from cachetools import TTLCache
+from fastapi import APIRouter, HTTPException, Request, Response
+from datetime import datetime, timedelta, timezone
+from typing import List, Dict, Any, Optional, Tuple
 from app.database import db
-from app.utils.pdf import generate_full_report_pdf
+from app.utils.pdf import generate_full_report_pdf_sync
 from app.models import ReportRequest, FullReportResponse
 
 
 router = APIRouter()
 
 # Constants
-EXCLUDED_CONTACTS = [
+EXCLUDED_CONTACTS = (
     "د/ محمد صيدلية بيش",
     "عيادة الأنعام - الإدارة",
     "مؤسسة علي محمد غروي البيطرية",
     "صيدليه علي محمد غروي",
     "عيادة الانعام الظبية"
-]
+)
 
 DATABASE_MAP = {
     "khamis": "Elanam-KhamisMushit",
@@ -23,188 +32,363 @@ DATABASE_MAP = {
     "zapia": "Elanam-Zapia"
 }
 
+# PDF rendering is CPU-bound, so it runs in worker processes off the event loop.
+# Managed by start_pdf_pool/stop_pdf_pool from the app lifespan.
+_pdf_pool: Optional[ProcessPoolExecutor] = None
+
+# Report windows that ended before this are treated as closed and cached longer
+HISTORICAL_CUTOFF = timedelta(days=1)
+
+# Report query results keyed by (db_option, start_date, end_date)
+_report_cache = TTLCache(maxsize=256, ttl=300)
+_historical_report_cache = TTLCache(maxsize=256, ttl=24 * 60 * 60)
+
+# Rendered PDFs keyed by a digest of the report data they were built from
+_pdf_cache = TTLCache(maxsize=64, ttl=24 * 60 * 60)
+
+# One lock per in-flight key so concurrent misses run the aggregations only once
+_report_locks: "WeakValueDictionary[tuple, asyncio.Lock]" = WeakValueDictionary()
+
+
+@router.post("/full-report/json", response_model=FullReportResponse)
+async def generate_full_report(request: ReportRequest, http_request: Request, response: Response):
+    try:
+        db_name = _resolve_db_name(request.db_option)
+        reports = await _get_reports(db_name, request)
+
+        # Clients re-opening the same report get a bodiless 304
+        etag = _etag(_report_digest(
+            reports["payment_report"], reports["clinic_report"], reports["sales_report"]
+        ))
+        if _etag_matches(http_request, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+        response.headers["ETag"] = etag
+
+        return {"success": True, **reports}
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Server error: {str(e)}")
+
 
-@router.post("/full-report", response_model=FullReportResponse)
-async def generate_full_report(request: ReportRequest):
+@router.post("/full-report/pdf")
+async def generate_full_report_pdf(request: ReportRequest, http_request: Request):
     try:
-        # 1. Connect to MongoDB
-        db_name = DATABASE_MAP.get(request.db_option)
-        if not db_name:
-            raise HTTPException(status_code=400, detail="Invalid database option")
+        db_name = _resolve_db_name(request.db_option)
+        reports = await _get_reports(db_name, request)
+
+        # Checked before rendering so a 304 skips the PDF build entirely
+        pdf_key = _pdf_key(db_name, request, reports)
+        etag = _etag(pdf_key)
+        if _etag_matches(http_request, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+
+        pdf_bytes = await _get_pdf(db_name, request, reports, pdf_key)
+
+        return Response(content=pdf_bytes, media_type="application/pdf", headers={"ETag": etag})
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Server error: {str(e)}")
+
+
+def _resolve_db_name(db_option: str) -> str:
+    """Map the client-facing option to the MongoDB database name"""
+    db_name = DATABASE_MAP.get(db_option)
+    if not db_name:
+        raise HTTPException(status_code=400, detail="Invalid database option")
+    return db_name
+
+
+def _cache_for(end_date: datetime) -> TTLCache:
+    """Pick the long-lived cache for closed historical windows"""
+    now = datetime.now(timezone.utc)
+    if end_date.tzinfo is None:
+        now = now.replace(tzinfo=None)
+    if end_date < now - HISTORICAL_CUTOFF:
+        return _historical_report_cache
+    return _report_cache
+
+
+def _report_digest(*parts) -> bytes:
+    """Stable digest of report structures, used as a cache key"""
+    payload = json.dumps(list(parts), sort_keys=True, default=str)
+    return hashlib.blake2b(payload.encode()).digest()
+
+
+def _etag(digest: bytes) -> str:
+    """Strong ETag header value for a report digest"""
+    return f'"{digest.hex()}"'
+
+
+def _etag_matches(http_request: Request, etag: str) -> bool:
+    """Whether the client's If-None-Match already covers this ETag"""
+    if_none_match = http_request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return etag in {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+
+
+async def _get_reports(db_name: str, request: ReportRequest) -> Dict[str, Any]:
+    """Get all three reports, serving from cache when built recently"""
+    key = (request.db_option, request.start_date.isoformat(), request.end_date.isoformat())
+    cache = _cache_for(request.end_date)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+
+    lock = _report_locks.get(key)
+    if lock is None:
+        lock = _report_locks[key] = asyncio.Lock()
+
+    async with lock:
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
 
         database = db.connect(db_name)
 
-        # 2. Fetch all reports concurrently
-        payment_report = await _get_payment_report(database, request.start_date, request.end_date)
-        clinic_report = await _get_clinic_report(database, request.start_date, request.end_date)
-        sales_report = await _get_sales_report(database, request.start_date, request.end_date)
-
-        # 3. Generate PDF
-        pdf_bytes = await generate_full_report_pdf(
-            payment_data=payment_report,
-            clinic_data=clinic_report,
-            sales_data=sales_report,
-            start_date=request.start_date,
-            end_date=request.end_date,
-            db_name=db_name
+        # Fetch all reports concurrently
+        payment_report, (clinic_report, sales_report) = await asyncio.gather(
+            _get_payment_report(database, request.start_date, request.end_date),
+            _get_sale_facets(database, request.start_date, request.end_date)
         )
 
-        return {
-            "success": True,
+        reports = {
             "payment_report": payment_report,
             "clinic_report": clinic_report,
-            "sales_report": sales_report,
-            "pdf_bytes": pdf_bytes.decode('latin1')  # Convert to string for JSON
+            "sales_report": sales_report
         }
+        cache[key] = reports
+        return reports
+
+
+def _pdf_key(db_name: str, request: ReportRequest, reports: Dict[str, Any]) -> bytes:
+    """Digest of everything that ends up in the rendered PDF"""
+    return _report_digest(
+        reports["payment_report"], reports["clinic_report"], reports["sales_report"],
+        db_name, request.start_date, request.end_date
+    )
+
+
+def start_pdf_pool() -> ProcessPoolExecutor:
+    """Create the PDF worker pool if it isn't running"""
+    global _pdf_pool
+    if _pdf_pool is None:
+        # The server process already runs Motor and anyio threads, so never fork it
+        _pdf_pool = ProcessPoolExecutor(
+            max_workers=os.cpu_count(),
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _pdf_pool
 
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Server error: {str(e)}")
-    finally:
-        db.close()
+
+def stop_pdf_pool():
+    """Shut the PDF worker pool down; the next PDF request starts a new one"""
+    global _pdf_pool
+    if _pdf_pool is not None:
+        _pdf_pool.shutdown(wait=False, cancel_futures=True)
+        _pdf_pool = None
+
+
+def _replace_broken_pdf_pool(broken: ProcessPoolExecutor) -> ProcessPoolExecutor:
+    """Swap out a pool whose worker crashed, unless another request already did"""
+    global _pdf_pool
+    if _pdf_pool is broken:
+        broken.shutdown(wait=False, cancel_futures=True)
+        _pdf_pool = None
+    return start_pdf_pool()
+
+
+async def _get_pdf(db_name: str, request: ReportRequest, reports: Dict[str, Any], pdf_key: bytes) -> bytes:
+    """Render the PDF, unless identical data was already rendered"""
+    pdf_bytes = _pdf_cache.get(pdf_key)
+    if pdf_bytes is None:
+        args = (
+            reports["payment_report"],
+            reports["clinic_report"],
+            reports["sales_report"],
+            request.start_date,
+            request.end_date,
+            db_name
+        )
+        loop = asyncio.get_running_loop()
+        pool = start_pdf_pool()
+        try:
+            pdf_bytes = await loop.run_in_executor(pool, generate_full_report_pdf_sync, *args)
+        except BrokenProcessPool:
+            # A crashed worker breaks the whole pool; replace it and retry once
+            pool = _replace_broken_pdf_pool(pool)
+            pdf_bytes = await loop.run_in_executor(pool, generate_full_report_pdf_sync, *args)
+        _pdf_cache[pdf_key] = pdf_bytes
+    return pdf_bytes
+
+
+def _with_date_range(template: List[Dict[str, Any]], start_date: datetime, end_date: datetime) -> List[Dict[str, Any]]:
+    """Copy a pipeline template with the createdAt range set on its leading $match"""
+    match = {"createdAt": {"$gte": start_date, "$lte": end_date}, **template[0]["$match"]}
+    return [{"$match": match}, *template[1:]]
+
+
+# Payment totals grouped by method and type (incoming/outgoing)
+_PAYMENT_PIPELINE_TEMPLATE = [
+    # createdAt range is filled in per request by _with_date_range
+    {"$match": {"isDeleted": False}},
+    {
+        "$group": {
+            "_id": {
+                "method": "$method",
+                "isOutgoing": "$isOutgoing"
+            },
+            "totalAmount": {"$sum": "$amount"},
+            "transactionCount": {"$sum": 1}
+        }
+    },
+    {
+        "$project": {
+            "method": "$_id.method",
+            "isOutgoing": "$_id.isOutgoing",
+            "totalAmount": 1,
+            "transactionCount": 1,
+            "_id": 0
+        }
+    }
+]
 
 
 async def _get_payment_report(db, start_date: datetime, end_date: datetime) -> List[Dict[str, Any]]:
     """Get payment totals grouped by method and type (incoming/outgoing)"""
-    pipeline = [
-        {
-            "$match": {
-                "createdAt": {"$gte": start_date, "$lte": end_date},
-                "isDeleted": False
-            }
-        },
-        {
-            "$group": {
-                "_id": {
-                    "method": "$method",
-                    "isOutgoing": "$isOutgoing"
-                },
-                "totalAmount": {"$sum": "$amount"},
-                "transactionCount": {"$sum": 1}
-            }
-        },
-        {
-            "$project": {
-                "method": "$_id.method",
-                "isOutgoing": "$_id.isOutgoing",
-                "totalAmount": 1,
-                "transactionCount": 1,
-                "_id": 0
-            }
+    pipeline = _with_date_range(_PAYMENT_PIPELINE_TEMPLATE, start_date, end_date)
+    return [doc async for doc in db["Payment"].aggregate(
+        pipeline, batchSize=100, allowDiskUse=True
+    )]
+
+
+# Clinic and sales reports as facets over one pass of the Sale collection
+_SALE_PIPELINE_TEMPLATE = [
+    # createdAt range is filled in per request by _with_date_range
+    {"$match": {"isDeleted": False}},
+    # Keep only the fields the facets use so $unwind works on small documents
+    {
+        "$project": {
+            "_id": 0,
+            "isResolved": 1,
+            "contactName": 1,
+            "services.serviceName": 1,
+            "services.price": 1,
+            "services.quantity": 1,
+            "items.productName": 1,
+            "items.pricePerUnit": 1,
+            "items.quantity": 1,
+            "items.profit": 1
         }
-    ]
-    return await db["Payment"].aggregate(pipeline).to_list(None)
-
-
-async def _get_clinic_report(db, start_date: datetime, end_date: datetime) -> Dict[str, float]:
-    """Get clinic revenue with special handling for 'لارج' services"""
-    pipeline = [
-        {
-            "$match": {
-                "createdAt": {"$gte": start_date, "$lte": end_date},
-                "isDeleted": False,
-                "isResolved": True
-            }
-        },
-        {"$unwind": "$services"},
-        {
-            "$addFields": {
-                "isLarge": {
-                    "$regexMatch": {
-                        "input": "$services.serviceName",
-                        "regex": "لارج"
+    },
+    {
+        "$facet": {
+            # Clinic revenue with special handling for 'لارج' services
+            "clinic": [
+                {"$match": {"isResolved": True}},
+                {"$unwind": "$services"},
+                {
+                    "$addFields": {
+                        # Plain substring check; cheaper than $regexMatch per row
+                        "isLarge": {
+                            "$gte": [
+                                {"$indexOfCP": ["$services.serviceName", "لارج"]},
+                                0
+                            ]
+                        },
+                        "serviceRevenue": {
+                            "$multiply": ["$services.price", "$services.quantity"]
+                        }
                     }
                 },
-                "serviceRevenue": {
-                    "$multiply": ["$services.price", "$services.quantity"]
+                {
+                    "$group": {
+                        "_id": None,
+                        "totalRevenue": {"$sum": "$serviceRevenue"},
+                        "largeServicesRevenue": {
+                            "$sum": {
+                                "$cond": [
+                                    "$isLarge", "$serviceRevenue", 0
+                                ]
+                            }
+                        },
+                        "normalServicesRevenue": {
+                            "$sum": {
+                                "$cond": [
+                                    "$isLarge", 0, "$serviceRevenue"
+                                ]
+                            }
+                        }
+                    }
                 }
-            }
-        },
-        {
-            "$group": {
-                "_id": None,
-                "totalRevenue": {"$sum": "$serviceRevenue"},
-                "largeServicesRevenue": {
-                    "$sum": {
-                        "$cond": [
-                            "$isLarge", "$serviceRevenue", 0
-                        ]
+            ],
+            # Sales revenue, profit and top 5 products, excluding specific contacts
+            "sales": [
+                {"$match": {"contactName": {"$nin": EXCLUDED_CONTACTS}}},
+                {"$unwind": "$items"},
+                # Pre-aggregate per product so the final group sees one row per product
+                {
+                    "$group": {
+                        "_id": "$items.productName",
+                        "revenue": {
+                            "$sum": {
+                                "$multiply": ["$items.pricePerUnit", "$items.quantity"]
+                            }
+                        },
+                        "profit": {"$sum": "$items.profit"}
                     }
                 },
-                "normalServicesRevenue": {
-                    "$sum": {
-                        "$cond": [
-                            "$isLarge", 0, "$serviceRevenue"
-                        ]
+                {
+                    "$group": {
+                        "_id": None,
+                        "totalRevenue": {"$sum": "$revenue"},
+                        "totalProfit": {"$sum": "$profit"},
+                        "topProducts": {
+                            "$topN": {
+                                "n": 5,
+                                "sortBy": {"revenue": -1},
+                                "output": {
+                                    "productName": "$_id",
+                                    "revenue": "$revenue",
+                                    "profit": "$profit"
+                                }
+                            }
+                        }
                     }
-                }
-            }
+                },
+                {"$project": {"_id": 0}}
+            ]
         }
-    ]
+    }
+]
 
-    result = await db["Sale"].aggregate(pipeline).to_list(None)
-    return result[0] if result else {
+
+async def _get_sale_facets(db, start_date: datetime, end_date: datetime) -> Tuple[Dict[str, float], Dict[str, Any]]:
+    """Get clinic and sales reports from a single pass over the Sale collection"""
+    pipeline = _with_date_range(_SALE_PIPELINE_TEMPLATE, start_date, end_date)
+
+    # $facet always yields a single document
+    result = await db["Sale"].aggregate(pipeline, allowDiskUse=True).to_list(1)
+    facets = result[0] if result else {}
+
+    clinic = facets.get("clinic")
+    clinic_report = clinic[0] if clinic else {
         "totalRevenue": 0,
         "largeServicesRevenue": 0,
         "normalServicesRevenue": 0
     }
 
-
-async def _get_sales_report(db, start_date: datetime, end_date: datetime) -> Dict[str, Any]:
-    """Get sales revenue and profit, excluding specific contacts"""
-    pipeline = [
-        {
-            "$match": {
-                "createdAt": {"$gte": start_date, "$lte": end_date},
-                "contactName": {"$nin": EXCLUDED_CONTACTS},
-                "isDeleted": False
-            }
-        },
-        {"$unwind": "$items"},
-        {
-            "$group": {
-                "_id": None,
-                "totalRevenue": {
-                    "$sum": {
-                        "$multiply": ["$items.pricePerUnit", "$items.quantity"]
-                    }
-                },
-                "totalProfit": {"$sum": "$items.profit"},
-                "topProducts": {
-                    "$push": {
-                        "productName": "$items.productName",
-                        "revenue": {
-                            "$multiply": ["$items.pricePerUnit", "$items.quantity"]
-                        },
-                        "profit": "$items.profit"
-                    }
-                }
-            }
-        },
-        {
-            "$project": {
-                "totalRevenue": 1,
-                "totalProfit": 1,
-                "topProducts": {
-                    "$slice": [
-                        {
-                            "$sortArray": {
-                                "input": "$topProducts",
-                                "sortBy": {"revenue": -1}
-                            }
-                        },
-                        5  # Return top 5 products
-                    ]
-                },
-                "_id": 0
-            }
-        }
-    ]
-
-    result = await db["Sale"].aggregate(pipeline).to_list(None)
-    return result[0] if result else {
+    sales = facets.get("sales")
+    sales_report = sales[0] if sales else {
         "totalRevenue": 0,
         "totalProfit": 0,
         "topProducts": []
-    }
\ No newline at end of file
+    }
+
+    return clinic_report, sales_report
@@ -1,4 +1,6 @@
+import logging
 from io import BytesIO
+from functools import lru_cache
 from datetime import datetime
 from reportlab.lib.pagesizes import letter
 from reportlab.platypus import (
@@ -6,34 +8,74 @@ from reportlab.platypus import (
     Paragraph,
     Spacer,
     Table,
+    LongTable,
     TableStyle,
     PageBreak
 )
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib import colors
 from reportlab.lib.units import inch
-import arabic_reshaper
+from arabic_reshaper import ArabicReshaper
 from bidi.algorithm import get_display
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
-import base64
+
+logger = logging.getLogger(__name__)
 
 
 # Arabic font setup (make sure 'assets/fonts/arabic.ttf' exists)
 def _setup_arabic_font():
     try:
         pdfmetrics.registerFont(TTFont('Arabic', 'assets/fonts/arabic.ttf'))
-    except:
+    except Exception:
         # Fallback to Arial if custom font not found
-        pdfmetrics.registerFont(TTFont('Arabic', 'Arial'))
+        try:
+            pdfmetrics.registerFont(TTFont('Arabic', 'Arial'))
+        except Exception:
+            # Runs at import time; let PDF builds fail instead of the whole app
+            logger.exception("Could not register Arabic font")
+
 
+# One reshaper with explicit configuration, shared by every call
+_RESHAPER = ArabicReshaper(configuration={
+    'delete_harakat': True,
+    'support_ligatures': True
+})
+_reshape = _RESHAPER.reshape
 
-# Arabic text formatter
+
+# Arabic text formatter (labels repeat across cells and requests, so memoize)
+@lru_cache(maxsize=4096)
 def _ar(text: str) -> str:
-    reshaped = arabic_reshaper.reshape(text)
+    reshaped = _reshape(text)
     return get_display(reshaped)
 
 
+# Bound once so table cells skip building an f-string per row
+SAR_FMT = "{:.2f} SAR".format
+
+# Static labels, reshaped once at import time
+TITLE = _ar("تقرير العيادة البيطرية الشامل")
+
+PAYMENT_HEADER = _ar("تقرير المدفوعات")
+PAYMENT_COLUMNS = [_ar("النوع"), _ar("الطريقة"), _ar("المبلغ"), _ar("عدد المعاملات")]
+OUTGOING_LABEL = _ar("صادر")
+INCOMING_LABEL = _ar("وارد")
+NETWORK_LABEL = _ar("شبكة")
+CASH_LABEL = _ar("كاش")
+PAYMENT_TYPE_LABELS = {True: OUTGOING_LABEL, False: INCOMING_LABEL}
+PAYMENT_METHOD_LABELS = {"network": NETWORK_LABEL}
+
+CLINIC_HEADER = _ar("تقرير العيادة")
+TOTAL_LABEL = _ar("الإجمالي")
+LARGE_SERVICES_LABEL = _ar("خدمات لارج")
+NORMAL_SERVICES_LABEL = _ar("خدمات عادية")
+
+SALES_HEADER = _ar("تقرير المبيعات والأرباح")
+TOP_PRODUCTS_LABEL = _ar("أفضل المنتجات:")
+PRODUCT_COLUMNS = [_ar("المنتج"), _ar("الإيراد"), _ar("الربح")]
+
+
 # Header style
 def _create_styles():
     styles = getSampleStyleSheet()
@@ -61,7 +103,12 @@ def _create_styles():
     return styles
 
 
-async def generate_full_report_pdf(
+# Fonts and styles are registered once per process, not per PDF
+_setup_arabic_font()
+STYLES = _create_styles()
+
+
+def generate_full_report_pdf_sync(
         payment_data: list,
         clinic_data: dict,
         sales_data: dict,
@@ -69,7 +116,7 @@ async def generate_full_report_pdf(
         end_date: datetime,
         db_name: str
 ) -> bytes:
-    """Generate PDF with all three reports"""
+    """Generate PDF with all three reports (CPU-bound; run it off the event loop)"""
     buffer = BytesIO()
     doc = SimpleDocTemplate(
         buffer,
@@ -80,68 +127,57 @@ async def generate_full_report_pdf(
         bottomMargin=36
     )
 
-    # Initialize fonts and styles
-    _setup_arabic_font()
-    styles = _create_styles()
     elements = []
 
     # 1. Cover Page
-    elements.append(Paragraph(_ar("تقرير العيادة البيطرية الشامل"), styles['ArabicTitle']))
+    elements.append(Paragraph(TITLE, STYLES['ArabicTitle']))
     elements.append(Spacer(1, 24))
-    elements.append(Paragraph(_ar(f"القاعدة: {db_name}"), styles['ArabicNormal']))
+    elements.append(Paragraph(_ar(f"القاعدة: {db_name}"), STYLES['ArabicNormal']))
     elements.append(Paragraph(
         _ar(f"الفترة من {start_date.strftime('%Y-%m-%d')} إلى {end_date.strftime('%Y-%m-%d')}"),
-        styles['ArabicNormal']
+        STYLES['ArabicNormal']
     ))
     elements.append(PageBreak())
 
     # 2. Payment Report
-    _add_payment_report(elements, payment_data, styles)
+    _add_payment_report(elements, payment_data, STYLES)
     elements.append(PageBreak())
 
     # 3. Clinic Report
-    _add_clinic_report(elements, clinic_data, styles)
+    _add_clinic_report(elements, clinic_data, STYLES)
     elements.append(PageBreak())
 
     # 4. Sales Report
-    _add_sales_report(elements, sales_data, styles)
+    _add_sales_report(elements, sales_data, STYLES)
 
     # Generate PDF
     doc.build(elements)
     pdf_bytes = buffer.getvalue()
     buffer.close()
 
-    return base64.b64encode(pdf_bytes).decode('latin1')
+    return pdf_bytes
+
+
+def _iter_payment_rows(data: list):
+    """Yield the payment table rows, header first, with labels already reshaped"""
+    yield list(PAYMENT_COLUMNS)
+    for item in data:
+        yield [
+            PAYMENT_TYPE_LABELS[bool(item['isOutgoing'])],
+            PAYMENT_METHOD_LABELS.get(item['method'], CASH_LABEL),
+            SAR_FMT(item['totalAmount']),
+            str(item['transactionCount'])
+        ]
 
 
 def _add_payment_report(elements: list, data: list, styles):
     """Add payment report section"""
-    elements.append(Paragraph(_ar("تقرير المدفوعات"), styles['ArabicHeader']))
+    elements.append(Paragraph(PAYMENT_HEADER, styles['ArabicHeader']))
     elements.append(Spacer(1, 12))
 
-    # Prepare table data
-    table_data = [
-        [
-            _ar("النوع"),
-            _ar("الطريقة"),
-            _ar("المبلغ"),
-            _ar("عدد المعاملات")
-        ]
-    ]
-
-    for item in data:
-        payment_type = _ar("صادر" if item['isOutgoing'] else "وارد")
-        method = _ar("شبكة" if item['method'] == "network" else "كاش")
-        table_data.append([
-            payment_type,
-            method,
-            f"{item['totalAmount']:.2f} SAR",
-            str(item['transactionCount'])
-        ])
-
-    # Create table
-    table = Table(
-        table_data,
+    # LongTable lays out row by row, keeping peak memory low for long tables
+    table = LongTable(
+        list(_iter_payment_rows(data)),
         colWidths=[1.2 * inch, 1.2 * inch, 1 * inch, 1 * inch],
         repeatRows=1
     )
@@ -161,14 +197,14 @@ def _add_payment_report(elements: list, data: list, styles):
 
 def _add_clinic_report(elements: list, data: dict, styles):
     """Add clinic report section"""
-    elements.append(Paragraph(_ar("تقرير العيادة"), styles['ArabicHeader']))
+    elements.append(Paragraph(CLINIC_HEADER, styles['ArabicHeader']))
     elements.append(Spacer(1, 12))
 
     # Summary table
     summary_data = [
-        [_ar("الإجمالي"), f"{data['totalRevenue']:.2f} SAR"],
-        [_ar("خدمات لارج"), f"{data['largeServicesRevenue']:.2f} SAR"],
-        [_ar("خدمات عادية"), f"{data['normalServicesRevenue']:.2f} SAR"]
+        [TOTAL_LABEL, SAR_FMT(data['totalRevenue'])],
+        [LARGE_SERVICES_LABEL, SAR_FMT(data['largeServicesRevenue'])],
+        [NORMAL_SERVICES_LABEL, SAR_FMT(data['normalServicesRevenue'])]
     ]
 
     summary_table = Table(
@@ -186,7 +222,7 @@ def _add_clinic_report(elements: list, data: dict, styles):
 
 def _add_sales_report(elements: list, data: dict, styles):
     """Add sales report section"""
-    elements.append(Paragraph(_ar("تقرير المبيعات والأرباح"), styles['ArabicHeader']))
+    elements.append(Paragraph(SALES_HEADER, styles['ArabicHeader']))
     elements.append(Spacer(1, 12))
 
     # Summary
@@ -202,18 +238,17 @@ def _add_sales_report(elements: list, data: dict, styles):
 
     # Top products table
     if data['topProducts']:
-        elements.append(Paragraph(_ar("أفضل المنتجات:"), styles['ArabicNormal']))
+        elements.append(Paragraph(TOP_PRODUCTS_LABEL, styles['ArabicNormal']))
 
-        table_data = [
-            [_ar("المنتج"), _ar("الإيراد"), _ar("الربح")]
-        ]
-
-        for product in data['topProducts']:
-            table_data.append([
+        table_data = [list(PRODUCT_COLUMNS)]
+        table_data += [
+            [
                 _ar(product['productName']),
-                f"{product['revenue']:.2f} SAR",
-                f"{product['profit']:.2f} SAR"
-            ])
+                SAR_FMT(product['revenue']),
+                SAR_FMT(product['profit'])
+            ]
+            for product in data['topProducts']
+        ]
 
         products_table = Table(
             table_data,
@@ -1,12 +1,51 @@
+import asyncio
+import gc
+import subprocess
+import sys
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
 import pytest
 from fastapi.testclient import TestClient
+from starlette.requests import Request
 from app.main import app
+from app.models import ReportRequest
+from app.routers import reports
+
+
+@asynccontextmanager
+async def _no_lifespan(app):
+    yield
 
-client = TestClient(app)
 
-def test_full_report():
+@pytest.fixture(scope="module")
+def client():
+    # Keep one event loop for the Motor client, but skip the real lifespan so
+    # the suite never runs create_index against the production databases
+    lifespan = app.router.lifespan_context
+    app.router.lifespan_context = _no_lifespan
+    try:
+        with TestClient(app) as test_client:
+            yield test_client
+    finally:
+        app.router.lifespan_context = lifespan
+
+def test_full_report(client):
+    response = client.post(
+        "/api/v1/full-report/json",
+        json={
+            "db_option": "khamis",
+            "start_date": "2024-01-01T00:00:00",
+            "end_date": "2024-12-31T23:59:59"
+        }
+    )
+    assert response.status_code == 200
+    assert len(response.json()["payment_report"]) > 0
+
+def test_full_report_pdf(client):
     response = client.post(
-        "/api/v1/full-report",
+        "/api/v1/full-report/pdf",
         json={
             "db_option": "khamis",
             "start_date": "2024-01-01T00:00:00",
@@ -14,5 +53,149 @@ def test_full_report():
         }
     )
     assert response.status_code == 200
-    assert "pdf_bytes" in response.json()
-    assert len(response.json()["payment_report"]) > 0
\ No newline at end of file
+    assert response.headers["content-type"] == "application/pdf"
+    assert response.content.startswith(b"%PDF")
+
+def test_full_report_not_modified(client):
+    payload = {
+        "db_option": "khamis",
+        "start_date": "2024-01-01T00:00:00",
+        "end_date": "2024-12-31T23:59:59"
+    }
+    etag = client.post("/api/v1/full-report/pdf", json=payload).headers["etag"]
+
+    response = client.post(
+        "/api/v1/full-report/pdf",
+        json=payload,
+        headers={"If-None-Match": etag}
+    )
+    assert response.status_code == 304
+    assert response.content == b""
+
+
+def _request_with(if_none_match):
+    headers = [] if if_none_match is None else [(b"if-none-match", if_none_match.encode())]
+    return Request({"type": "http", "headers": headers})
+
+@pytest.mark.parametrize("if_none_match, expected", [
+    (None, False),
+    ('"abc"', True),
+    ('"other"', False),
+    ('"other", "abc"', True),
+    ('"other",W/"abc"', True),
+    ('W/"abc"', True),
+    ("*", True),
+])
+def test_etag_matches(if_none_match, expected):
+    assert reports._etag_matches(_request_with(if_none_match), '"abc"') is expected
+
+def test_full_report_json_not_modified_keeps_etag(client, monkeypatch):
+    async def fake_reports(db_name, request):
+        return {
+            "payment_report": [
+                {"method": "network", "isOutgoing": False, "totalAmount": 100.0, "transactionCount": 2}
+            ],
+            "clinic_report": {
+                "totalRevenue": 50.0, "largeServicesRevenue": 20.0, "normalServicesRevenue": 30.0
+            },
+            "sales_report": {"totalRevenue": 10.0, "totalProfit": 4.0, "topProducts": []}
+        }
+
+    def no_database(db_name):
+        raise AssertionError("offline test reached MongoDB")
+
+    monkeypatch.setattr(reports, "_get_reports", fake_reports)
+    monkeypatch.setattr(reports.db, "connect", no_database)
+    payload = {
+        "db_option": "khamis",
+        "start_date": "2024-01-01T00:00:00",
+        "end_date": "2024-12-31T23:59:59"
+    }
+
+    first = client.post("/api/v1/full-report/json", json=payload)
+    assert first.status_code == 200
+    etag = first.headers["etag"]
+
+    second = client.post(
+        "/api/v1/full-report/json",
+        json=payload,
+        headers={"If-None-Match": etag}
+    )
+    assert second.status_code == 304
+    assert second.headers["etag"] == etag
+
+def test_pdf_worker_import_creates_no_db_client():
+    # Spawned PDF workers import app.utils.pdf to unpickle the render function;
+    # that import chain must not build a Mongo client (or touch DNS)
+    code = "import app.utils.pdf, app.database as d; assert d.db._client is None"
+    subprocess.run([sys.executable, "-c", code], check=True, cwd=Path(__file__).resolve().parents[1])
+
+@pytest.fixture
+def fake_aggregations(monkeypatch):
+    calls = []
+
+    async def fake_payment_report(database, start_date, end_date):
+        calls.append((start_date, end_date))
+        await asyncio.sleep(0.01)  # Keep the miss in flight so concurrent callers overlap
+        return []
+
+    async def fake_sale_facets(database, start_date, end_date):
+        return (
+            {"totalRevenue": 0, "largeServicesRevenue": 0, "normalServicesRevenue": 0},
+            {"totalRevenue": 0, "totalProfit": 0, "topProducts": []}
+        )
+
+    monkeypatch.setattr(reports, "_get_payment_report", fake_payment_report)
+    monkeypatch.setattr(reports, "_get_sale_facets", fake_sale_facets)
+    monkeypatch.setattr(reports.db, "connect", lambda db_name: None)
+    reports._report_cache.clear()
+    reports._historical_report_cache.clear()
+    yield calls
+    reports._report_cache.clear()
+    reports._historical_report_cache.clear()
+
+def _report_request(end_date):
+    return ReportRequest(db_option="khamis", start_date=end_date - timedelta(days=30), end_date=end_date)
+
+def test_concurrent_report_misses_aggregate_once(fake_aggregations):
+    request = _report_request(datetime(2024, 3, 31))
+
+    async def many_misses():
+        return await asyncio.gather(*(
+            reports._get_reports("Elanam-KhamisMushit", request) for _ in range(20)
+        ))
+
+    results = asyncio.run(many_misses())
+
+    assert len(fake_aggregations) == 1
+    assert all(result is results[0] for result in results)
+    gc.collect()
+    assert len(reports._report_locks) == 0
+
+def test_cached_report_skips_aggregation(fake_aggregations):
+    request = _report_request(datetime(2024, 3, 31))
+
+    asyncio.run(reports._get_reports("Elanam-KhamisMushit", request))
+    asyncio.run(reports._get_reports("Elanam-KhamisMushit", request))
+
+    assert len(fake_aggregations) == 1
+
+@pytest.mark.parametrize("end_date, historical", [
+    (datetime(2024, 3, 31), True),
+    (datetime.now(), False),
+    (datetime(2024, 3, 31, tzinfo=timezone.utc), True),
+    (datetime.now(timezone.utc), False),
+    (datetime.now(timezone(timedelta(hours=3))), False),
+    (datetime.now(timezone.utc) - timedelta(days=2), True),
+])
+def test_cache_for_picks_ttl_by_window_end(end_date, historical):
+    expected = reports._historical_report_cache if historical else reports._report_cache
+    assert reports._cache_for(end_date) is expected
+
+def test_historical_report_lands_in_long_lived_cache(fake_aggregations):
+    request = _report_request(datetime(2024, 3, 31))
+
+    asyncio.run(reports._get_reports("Elanam-KhamisMushit", request))
+
+    assert len(reports._historical_report_cache) == 1
+    assert len(reports._report_cache) == 0